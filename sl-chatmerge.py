@@ -8,9 +8,14 @@ Synchronizes and merges Second Life chat logs across multiple workstations and v
 import argparse
 import os
 import re
+import shutil
 import sys
+import threading
+import zlib
+from concurrent.futures import FIRST_EXCEPTION, ThreadPoolExecutor, wait
+from itertools import groupby
 from pathlib import Path
-from typing import Dict, List, Set, Tuple, Optional
+from typing import Dict, FrozenSet, List, Set, Tuple, Optional
 
 
 # Configuration: Directory paths and access modes
@@ -28,7 +33,7 @@ DIRECTORIES = [
     {"path": "~/home/Mega/Apps/SL-Logs-and-Settings/SL-Chat/", "mode": "rw"},
 ]
 
-# System files to exclude (matched at end of path)
+# System files to exclude (matched on file name)
 EXCLUDED_FILES = [
     "avatar_icons_cache.txt",
     "cef_log.txt",
@@ -45,26 +50,77 @@ EXCLUDED_DIRECTORIES = [
     "user_settings/",
 ]
 
+# Lowercased exclusion tables, precomputed for set lookup by file name / first path component
+_EXCLUDED_BASENAMES = frozenset(excluded.lower() for excluded in EXCLUDED_FILES)
+_EXCLUDED_TOP = frozenset(excluded_dir.rstrip("/").lower() for excluded_dir in EXCLUDED_DIRECTORIES)
+
+# Pattern for the start of a chat entry:
+#   [YYYY/MM/DD HH:MM:SS] or [YYYY/MM/DD HH:MM] or [YYYY/MM/DD HH:MM AM/PM] (standard format)
+#   YYYY/MM/DD HH:MM (old format without brackets)
+# Standard format: 20 chars (with seconds), Short format: 17-19 chars (without seconds)
+# 12-hour format: 20-22 chars (with AM/PM)
+# Hours and minutes can be 1-2 digits
+# Old format: Missing brackets, e.g., "2009/06/03 10:12Mykel String:"
+# Splitting on a newline followed by this pattern yields whole entries: every line
+# without a timestamp stays attached to the entry above it
+_ENTRY_SPLIT = re.compile(
+    rb'\n(?=\[?\d{4}/\d{2}/\d{2} \d{1,2}:\d{1,2}(?::\d{2})?(?:\]| [AP]M\])?)'
+)
+
+# Pattern to extract timestamp components for normalization (including optional brackets and AM/PM)
+# Supports both [YYYY/MM/DD HH:MM] and YYYY/MM/DD HH:MM (old format without brackets)
+_TS_PARSE = re.compile(
+    rb'^\[?(\d{4})/(\d{2})/(\d{2}) (\d{1,2}):(\d{1,2})(?::(\d{2}))?(?:\]|( [AP]M)\]?)?'
+)
+
+# Same as _TS_PARSE, but applied to every line at once and skipping timestamps already in
+# normalized form ([YYYY/MM/DD HH:MM:SS] or [YYYY/MM/DD HH:MM]), so only lines that need
+# rewriting reach the Python callback
+_TS_NEEDS_NORMALIZING = re.compile(
+    rb'^(?!\[\d{4}/\d{2}/\d{2} \d{2}:\d{2}(?::\d{2})?\])'
+    rb'\[?(\d{4})/(\d{2})/(\d{2}) (\d{1,2}):(\d{1,2})(?::(\d{2}))?(?:\]|( [AP]M)\]?)?',
+    re.MULTILINE
+)
+
+# Read size used when comparing existing files against merged content
+COMPARE_CHUNK_SIZE = 1024 * 1024
+
+# Bytes hashed from each end of a file when same-size copies are fingerprinted
+FINGERPRINT_BLOCK_SIZE = 64 * 1024
+
+# Flags for creating temporary files: fail if the name is taken, and never translate
+# line endings (O_BINARY only exists, and only matters, on Windows)
+_TMP_OPEN_FLAGS = os.O_WRONLY | os.O_CREAT | os.O_EXCL | getattr(os, "O_BINARY", 0)
+
+# Worker threads used to merge files concurrently (work is dominated by file I/O)
+MAX_WORKERS = 16
+
 # Global flags
 VERBOSE = False
 DRY_RUN = False
 FORCE = False
 
+# Serializes console output from worker threads
+_output_lock = threading.Lock()
+
 
 def log_verbose(message: str) -> None:
     """Print message if verbose mode is enabled."""
     if VERBOSE:
-        print(f"[VERBOSE] {message}")
+        with _output_lock:
+            print(f"[VERBOSE] {message}")
 
 
 def log_info(message: str) -> None:
     """Print informational message."""
-    print(message)
+    with _output_lock:
+        print(message)
 
 
 def log_error(message: str) -> None:
     """Print error message to stderr."""
-    print(f"ERROR: {message}", file=sys.stderr)
+    with _output_lock:
+        print(f"ERROR: {message}", file=sys.stderr)
 
 
 def expand_path(path: str) -> Path:
@@ -83,21 +139,29 @@ def expand_path(path: str) -> Path:
     return Path(expanded)
 
 
-def validate_config() -> List[Dict[str, str]]:
+def validate_config(dirs: Optional[List[Dict[str, str]]] = None) -> List[Dict[str, str]]:
     """
-    Validate the DIRECTORIES configuration.
+    Validate a directory configuration.
     
+    Args:
+        dirs: Directory configurations to validate (defaults to DIRECTORIES)
+        
     Returns:
         Validated list of directory configurations
         
     Raises:
         SystemExit: If configuration is invalid
     """
-    if not DIRECTORIES:
-        log_error("No directories configured in DIRECTORIES constant")
+    source = ""
+    if dirs is None:
+        dirs = DIRECTORIES
+        source = " in DIRECTORIES constant"
+    
+    if not dirs:
+        log_error(f"No directories configured{source}")
         sys.exit(1)
     
-    for idx, dir_config in enumerate(DIRECTORIES):
+    for idx, dir_config in enumerate(dirs):
         if "mode" not in dir_config:
             log_error(f"Directory entry {idx} is missing 'mode' field")
             sys.exit(1)
@@ -110,7 +174,7 @@ def validate_config() -> List[Dict[str, str]]:
             log_error(f"Directory entry {idx} is missing 'path' field")
             sys.exit(1)
     
-    return DIRECTORIES
+    return dirs
 
 
 def check_directory_exists(dir_config: Dict[str, str]) -> Tuple[bool, Optional[Path]]:
@@ -187,6 +251,22 @@ def check_for_duplicate_directories(directories: List[Tuple[Path, str]]) -> List
     return unique_dirs
 
 
+def dir_prefix(dir_path: Path) -> str:
+    """
+    Convert a directory path to a string ending with a separator.
+    
+    Relative file paths can then be appended with plain string concatenation,
+    avoiding Path construction in the per-file loops.
+    
+    Args:
+        dir_path: Directory path
+        
+    Returns:
+        Directory path as a string with a trailing separator
+    """
+    return str(dir_path).rstrip(os.sep) + os.sep
+
+
 def should_exclude_file(relative_path: str) -> bool:
     """
     Check if a file should be excluded based on path patterns.
@@ -197,81 +277,162 @@ def should_exclude_file(relative_path: str) -> bool:
     Returns:
         True if file should be excluded
     """
-    # Exclude files with "conflicted copy" in path (case-insensitive)
-    if "conflicted copy" in relative_path.lower():
-        return True
-    
-    # Exclude specific system files (matched at end of path, case-insensitive)
-    relative_path_lower = relative_path.lower()
-    for excluded in EXCLUDED_FILES:
-        if relative_path_lower.endswith("/" + excluded.lower()):
-            return True
-    
-    return False
+    return _should_exclude_lower(relative_path.lower())
+
+
+def _should_exclude_lower(relative_path_lower: str) -> bool:
+    """Exclusion check for a relative path that is already lowercase."""
+    # Exclude files with "conflicted copy" in path, and specific system files matched on file name
+    return (
+        "conflicted copy" in relative_path_lower
+        or relative_path_lower.rsplit("/", 1)[-1] in _EXCLUDED_BASENAMES
+    )
 
 
-def discover_files(directories: List[Tuple[Path, str]], filters: List[str]) -> Set[str]:
+def _iter_txt(root: str, excluded_dirs: FrozenSet[str]) -> List[Tuple[str, int]]:
+    """
+    Recursively collect .txt files below root using os.scandir.
+    
+    Top-level directories named in excluded_dirs are pruned before descending,
+    so their subtrees are never enumerated. File sizes come from the directory
+    entries, so callers do not need a separate stat per file.
+    
+    Args:
+        root: Directory to scan
+        excluded_dirs: Lowercase top-level directory names to skip
+        
+    Returns:
+        List of (relative path using forward slashes, size in bytes) tuples
+    """
+    found: List[Tuple[str, int]] = []
+    stack: List[Tuple[str, str]] = [(root, "")]
+    
+    while stack:
+        abs_dir, rel_prefix = stack.pop()
+        try:
+            with os.scandir(abs_dir) as entries:
+                for entry in entries:
+                    name = entry.name
+                    if entry.is_dir(follow_symlinks=False):
+                        if not rel_prefix and name.lower() in excluded_dirs:
+                            log_verbose(f"Excluding (in excluded directory): {name}/")
+                            continue
+                        stack.append((entry.path, rel_prefix + name + "/"))
+                    elif name.lower().endswith(".txt"):
+                        try:
+                            size = entry.stat().st_size
+                        except OSError as e:
+                            log_verbose(f"Cannot stat {entry.path}: {e}")
+                            continue
+                        found.append((rel_prefix + name, size))
+        except OSError as e:
+            log_verbose(f"Cannot scan {abs_dir}: {e}")
+    
+    return found
+
+
+def discover_files(
+    directories: List[Tuple[str, str]],
+    filters: List[str]
+) -> Tuple[Set[str], Dict[Tuple[int, str], int]]:
     """
     Discover all .txt files across readable directories.
     
     Scans user-specific subdirectories (e.g., UserName/*.txt) but excludes
-    certain directories like logs/ and user_settings/.
+    certain directories like logs/ and user_settings/. Every directory,
+    including write-only ones, is scanned to record file sizes for the
+    identical-size check in merge_and_sync_file. Directories often live on
+    different volumes, so they are walked concurrently, one thread each.
     
     Args:
-        directories: List of (path, mode) tuples for existing directories
+        directories: List of (path prefix, mode) tuples for existing directories
         filters: Optional substring filters for file paths
         
     Returns:
-        Set of relative file paths (relative to each directory root)
+        Tuple of (set of relative file paths, sizes keyed by (directory index, relative path))
     """
     all_files: Set[str] = set()
+    sizes: Dict[Tuple[int, str], int] = {}
+    filters_lower = [f.lower() for f in filters]
     
-    for dir_path, mode in directories:
-        # Only scan readable directories
-        if mode not in ("r", "rw"):
-            continue
-        
+    for dir_path, _ in directories:
         log_verbose(f"Scanning directory: {dir_path}")
-        
-        # Recursively find all .txt files in the base directory
-        for txt_file in dir_path.rglob("*.txt"):
-            # Get relative path from the directory root
-            try:
-                relative = txt_file.relative_to(dir_path)
-                relative_str = str(relative).replace(os.sep, "/")  # Ensure forward slashes
-                
-                # Exclude files in excluded directories (case-insensitive)
-                relative_str_lower = relative_str.lower()
-                if any(relative_str_lower.startswith(excluded_dir.lower()) for excluded_dir in EXCLUDED_DIRECTORIES):
-                    log_verbose(f"Excluding (in excluded directory): {relative_str}")
-                    continue
-                
-                # Apply exclusion filters
-                if should_exclude_file(relative_str):
-                    log_verbose(f"Excluding: {relative_str}")
-                    continue
-                
-                # Apply user filters if provided
-                if filters:
-                    if not any(f.lower() in relative_str.lower() for f in filters):
-                        continue
-                
-                all_files.add(relative_str)
-                log_verbose(f"Found: {relative_str}")
-            except ValueError:
-                # File is not relative to dir_path, skip
+    
+    # Recursively find all .txt files in each base directory, all directories at once
+    with ThreadPoolExecutor(max_workers=len(directories) or 1) as executor:
+        scans = list(executor.map(lambda directory: _iter_txt(directory[0], _EXCLUDED_TOP), directories))
+    
+    # Results are combined in directory order, so discovery stays deterministic
+    for dir_idx, ((_, mode), found) in enumerate(zip(directories, scans)):
+        for relative_str, size in found:
+            sizes[(dir_idx, relative_str)] = size
+            
+            # Only readable directories contribute files to merge
+            if mode not in ("r", "rw"):
                 continue
+            
+            # Already accepted while scanning an earlier directory
+            if relative_str in all_files:
+                continue
+            
+            # Lowercase once for all case-insensitive checks
+            relative_lower = relative_str.lower()
+            
+            # Apply exclusion filters
+            if _should_exclude_lower(relative_lower):
+                log_verbose(f"Excluding: {relative_str}")
+                continue
+            
+            # Apply user filters if provided
+            if filters_lower:
+                if not any(f in relative_lower for f in filters_lower):
+                    continue
+            
+            all_files.add(relative_str)
+            log_verbose(f"Found: {relative_str}")
     
     log_info(f"Discovered {len(all_files)} unique chat log files")
-    return all_files
+    return all_files, sizes
 
 
-def sort_chat_log(content: str, file_path: str) -> str:
+def _normalize_ts(match: "re.Match[bytes]") -> bytes:
+    """
+    Build a normalized timestamp from a _TS_NEEDS_NORMALIZING match.
+    
+    Pads hours and minutes to 2 digits and converts AM/PM to 24-hour format.
+    
+    Args:
+        match: Match object for a timestamp prefix
+        
+    Returns:
+        Timestamp in [YYYY/MM/DD HH:MM:SS] or [YYYY/MM/DD HH:MM] form
+    """
+    year, month, day, hour, minute, second, ampm = match.groups()
+    hour_value = int(hour)
+    
+    # Convert 12-hour format to 24-hour format
+    if ampm:
+        ampm = ampm.strip()  # Remove leading space
+        if ampm == b'AM':
+            if hour_value == 12:
+                hour_value = 0  # 12 AM is 00:00
+        elif ampm == b'PM':
+            if hour_value != 12:
+                hour_value += 12  # 1-11 PM becomes 13-23
+            # 12 PM stays as 12
+    
+    # Reconstruct timestamp (always in 24-hour format, no AM/PM in output)
+    if second:
+        return b"[%s/%s/%s %02d:%02d:%s]" % (year, month, day, hour_value, int(minute), second)
+    return b"[%s/%s/%s %02d:%02d]" % (year, month, day, hour_value, int(minute))
+
+
+def sort_chat_log(content: bytes, file_path: str) -> bytes:
     """
     Sort and deduplicate chat log entries chronologically.
     
     Args:
-        content: Raw chat log content
+        content: Raw chat log content as bytes
         file_path: Path for error reporting
         
     Returns:
@@ -280,264 +441,339 @@ def sort_chat_log(content: str, file_path: str) -> str:
     Raises:
         ValueError: If malformed timestamps are detected
     """
-    # Step 1: Normalize line endings (CRLF -> LF)
-    content = content.replace('\r\n', '\n').replace('\r', '\n')
+    # Step 1: Normalize line endings (CRLF or lone CR -> LF) and drop empty lines
+    # bytes.replace sizes its output once, where a regex substitution would build a
+    # list of pieces per line break and peak at several times the file size
+    if b'\r' in content:
+        content = content.replace(b'\r\n', b'\n').replace(b'\r', b'\n')
+    while b'\n\n' in content:
+        content = content.replace(b'\n\n', b'\n')
+    content = content.strip(b'\n')
     
     if not content:
-        return ''  # Empty file stays empty
-    
-    lines = content.split('\n')
-    
-    # Step 2: Join multi-line entries
-    # Pattern for timestamp: 
-    #   [YYYY/MM/DD HH:MM:SS] or [YYYY/MM/DD HH:MM] or [YYYY/MM/DD HH:MM AM/PM] (standard format)
-    #   YYYY/MM/DD HH:MM (old format without brackets)
-    # Standard format: 20 chars (with seconds), Short format: 17-19 chars (without seconds)
-    # 12-hour format: 20-22 chars (with AM/PM)
-    # Hours and minutes can be 1-2 digits
-    # Old format: Missing brackets, e.g., "2009/06/03 10:12Mykel String:"
-    timestamp_pattern = re.compile(
-        r'^(?:\[?\d{4}/\d{2}/\d{2} \d{1,2}:\d{1,2}(?::\d{2})?(?:\]| [AP]M\])?)'
-    )
+        return b''  # Empty file stays empty
+    
+    # Step 2: Normalize timestamps in a single pass over the whole content
+    # Only timestamps at the start of a line are touched, and every such line starts an entry
+    content = _TS_NEEDS_NORMALIZING.sub(_normalize_ts, content)
+    
+    # Step 3: Join multi-line entries
+    # The entries are copies, so the normalized buffer is released as soon as it is split
+    entries = _ENTRY_SPLIT.split(content)
+    del content
+    
+    # Step 4: Validate timestamps
+    # Every entry after the first starts with a timestamp by construction, so only
+    # leading text before the first timestamp can be malformed
+    first_line = entries[0].split(b'\n', 1)[0]
+    if (first_line[0:1].isdigit() or first_line.startswith(b'[')) and not _TS_PARSE.match(first_line):
+        raise ValueError(
+            f"Malformed timestamp in {file_path}:\n"
+            f"  Line: {first_line.decode('utf-8', errors='replace')[:80]}\n"
+            f"  Expected format: [YYYY/MM/DD HH:MM:SS], [YYYY/MM/DD HH:MM], [YYYY/MM/DD HH:MM AM/PM], or YYYY/MM/DD HH:MM (old format)"
+        )
+    
+    # Step 5: Remove duplicates
+    # Merged copies repeat the same entries, so dropping them before sorting shrinks the sort.
+    # Identical entries always end up adjacent after the full-entry sort, so this matches
+    # removing consecutive duplicates from the sorted output (like Unix uniq)
+    # Rebinding drops the duplicate entries before the sort and join allocate more memory
+    entries = list(dict.fromkeys(entries))
+    
+    # Step 6: Sort by timestamp, then by full entry content for stability
+    # Timestamps are now normalized, so all have consistent format
+    # Entries are bytes, so sorting the full entry is a byte-wise, locale-independent comparison;
+    # no key function is needed and the fresh list from Step 5 is sorted in place
+    entries.sort()
     
-    entries: List[str] = []
-    current_entry: List[str] = []
-    
-    for line in lines:
-        if timestamp_pattern.match(line):
-            # Start of new entry
-            if current_entry:
-                entries.append('\n'.join(current_entry))
-            current_entry = [line]
-        elif line:  # Non-empty continuation line
-            # Continuation of current entry (including lines with just whitespace)
-            if current_entry:
-                current_entry.append(line)
-            else:  # First line without timestamp
-                current_entry = [line]
-    
-    # Add last entry
-    if current_entry:
-        entries.append('\n'.join(current_entry))
-    
-    # Step 3: Validate and normalize timestamps
-    # Pattern to extract timestamp components for normalization (including optional brackets and AM/PM)
-    # Supports both [YYYY/MM/DD HH:MM] and YYYY/MM/DD HH:MM (old format without brackets)
-    timestamp_parse = re.compile(
-        r'^\[?(\d{4})/(\d{2})/(\d{2}) (\d{1,2}):(\d{1,2})(?::(\d{2}))?(?:\]|( [AP]M)\]?)?'
-    )
+    # Step 7: Join with newlines and ensure trailing newline
+    result = b'\n'.join(entries)
+    if result and not result.endswith(b'\n'):
+        result += b'\n'
     
-    normalized_entries: List[str] = []
-    for entry in entries:
-        lines_in_entry = entry.split('\n')
-        first_line = lines_in_entry[0]
+    return result
+
+
+def read_file_content(file_path: str) -> bytes:
+    """
+    Read raw file content.
+    
+    Content is kept as bytes so no decode/encode round trip is needed and
+    files in any encoding are merged and written back unchanged.
+    
+    Args:
+        file_path: Path to file
         
-        # Check if line starts with a timestamp (with or without bracket)
-        if first_line[0:1].isdigit() or first_line.startswith('['):
-            match = timestamp_parse.match(first_line)
-            if not match:
-                raise ValueError(
-                    f"Malformed timestamp in {file_path}:\n"
-                    f"  Line: {first_line[:80]}\n"
-                    f"  Expected format: [YYYY/MM/DD HH:MM:SS], [YYYY/MM/DD HH:MM], [YYYY/MM/DD HH:MM AM/PM], or YYYY/MM/DD HH:MM (old format)"
-                )
-            
-            # Normalize timestamp: pad hours and minutes to 2 digits, convert AM/PM to 24-hour
-            year, month, day, hour, minute, second, ampm = match.groups()
-            hour = int(hour)
-            minute = int(minute)
-            
-            # Convert 12-hour format to 24-hour format
-            if ampm:
-                ampm = ampm.strip()  # Remove leading space
-                if ampm == 'AM':
-                    if hour == 12:
-                        hour = 0  # 12 AM is 00:00
-                elif ampm == 'PM':
-                    if hour != 12:
-                        hour += 12  # 1-11 PM becomes 13-23
-                    # 12 PM stays as 12
-            
-            # Format with leading zeros
-            hour_str = str(hour).zfill(2)
-            minute_str = str(minute).zfill(2)
-            
-            # Reconstruct timestamp (always in 24-hour format, no AM/PM in output)
-            if second:
-                normalized_ts = f"[{year}/{month}/{day} {hour_str}:{minute_str}:{second}]"
-            else:
-                normalized_ts = f"[{year}/{month}/{day} {hour_str}:{minute_str}]"
-            
-            # Replace first line with normalized timestamp
-            remainder = first_line[match.end():]  # Everything after the timestamp
-            lines_in_entry[0] = normalized_ts + remainder
-            normalized_entries.append('\n'.join(lines_in_entry))
-        else:
-            # Entry doesn't start with timestamp (shouldn't happen, but preserve it)
-            normalized_entries.append(entry)
+    Returns:
+        File content as bytes
+    """
+    with open(file_path, 'rb') as f:
+        return f.read()
+
+
+def file_matches(file_path: str, data: bytes) -> bool:
+    """
+    Check whether a file's content equals data, reading it in chunks.
     
-    # Step 4: Sort by timestamp, then by full entry content for stability
-    # Use UTF-8 encoding to properly handle Unicode characters
-    # Timestamps are now normalized, so all have consistent format
-    def sort_key(entry: str) -> bytes:
-        # Sort by full entry to ensure stable, deterministic ordering
-        # This ensures identical entries sort together for deduplication
-        # Use UTF-8 to preserve Unicode characters that may appear at end of entries
-        return entry.encode('utf-8')
-    
-    sorted_entries = sorted(normalized_entries, key=sort_key)
-    
-    # Step 5: Remove consecutive duplicates
-    deduplicated: List[str] = []
-    prev_entry = None
-    for entry in sorted_entries:
-        if entry != prev_entry:
-            deduplicated.append(entry)
-            prev_entry = entry
-    
-    # Step 6: Join with newlines and ensure trailing newline
-    result = '\n'.join(deduplicated)
-    if result and not result.endswith('\n'):
-        result += '\n'
+    Stops at the first differing chunk, and never holds more than one chunk
+    of the file in memory.
     
-    return result
+    Args:
+        file_path: Path to file
+        data: Expected content
+        
+    Returns:
+        True if the file content is identical to data
+    """
+    with open(file_path, 'rb') as f:
+        offset = 0
+        for chunk in iter(lambda: f.read(COMPARE_CHUNK_SIZE), b''):
+            end = offset + len(chunk)
+            if chunk != data[offset:end]:
+                return False
+            offset = end
+    return offset == len(data)
 
 
-def read_file_content(file_path: Path) -> str:
+def file_fingerprint(file_path: str) -> Optional[int]:
     """
-    Read file content, handling encoding issues.
+    Compute a cheap fingerprint of a file from its first and last blocks.
+    
+    Chat logs are append-only, so copies that diverged almost always differ near
+    the end; the head catches edits to older history. Files no larger than two
+    blocks are hashed in full.
     
     Args:
         file_path: Path to file
         
     Returns:
-        File content as string
+        CRC-32 of the head and tail blocks, or None if the file cannot be read
+    """
+    try:
+        with open(file_path, 'rb') as f:
+            head = f.read(FINGERPRINT_BLOCK_SIZE)
+            if f.seek(0, os.SEEK_END) > 2 * FINGERPRINT_BLOCK_SIZE:
+                f.seek(-FINGERPRINT_BLOCK_SIZE, os.SEEK_END)
+            else:
+                f.seek(len(head))
+            tail = f.read()
+    except OSError:
+        return None
+    return zlib.crc32(tail, zlib.crc32(head))
+
+
+def write_file_atomic(file_path: str, data: bytes) -> None:
+    """
+    Write data to a file atomically.
+    
+    The data is written to a temporary sibling file which then replaces the
+    destination, so an interrupted run never leaves a partially written log.
+    Symlinks are followed so the link target is updated, and an existing
+    file's permissions are carried over to the replacement.
+    
+    Args:
+        file_path: Destination path
+        data: Content to write
     """
+    target = os.path.realpath(file_path)
+    # A unique name per writer, since two relative paths can name the same file on
+    # case-insensitive file systems and be written concurrently.
+    # Mode 0o666 lets the umask decide a new log's permissions, as open() would
+    while True:
+        tmp_path = f"{target}.{os.urandom(4).hex()}.tmp"
+        try:
+            fd = os.open(tmp_path, _TMP_OPEN_FLAGS, 0o666)
+            break
+        except FileExistsError:
+            continue
     try:
-        return file_path.read_text(encoding='utf-8')
-    except UnicodeDecodeError:
-        # Try latin-1 as fallback
-        log_verbose(f"UTF-8 decode failed, trying latin-1: {file_path}")
-        return file_path.read_text(encoding='latin-1')
+        with os.fdopen(fd, 'wb') as f:
+            f.write(data)
+        if os.path.exists(target):
+            shutil.copymode(target, tmp_path)
+        os.replace(tmp_path, target)
+    except BaseException:
+        # Don't leave the temporary file behind
+        try:
+            os.unlink(tmp_path)
+        except OSError:
+            pass
+        raise
 
 
 def merge_and_sync_file(
     relative_path: str,
-    directories: List[Tuple[Path, str]]
+    directories: List[Tuple[str, str]],
+    sizes: Optional[Dict[Tuple[int, str], int]] = None
 ) -> None:
     """
     Merge a single file across all directories.
     
     Args:
         relative_path: Relative path from directory root
-        directories: List of (path, mode) tuples
+        directories: List of (path prefix, mode) tuples, see dir_prefix()
+        sizes: File sizes from discover_files for the same directories list;
+            if omitted, sizes are read from the file system
     """
     log_verbose(f"Processing: {relative_path}")
     
     # Step -1: Skip excluded directories (case-insensitive)
-    relative_path_lower = relative_path.lower()
-    if any(relative_path_lower.startswith(excluded_dir.lower()) for excluded_dir in EXCLUDED_DIRECTORIES):
+    if relative_path.split("/", 1)[0].lower() in _EXCLUDED_TOP:
         log_verbose(f"  Skipping excluded directory: {relative_path}")
         return
     
     # Step 0: Quick optimization - check if all versions have identical file sizes across ALL directories
-    # If so, they're likely identical and we can skip processing (unless --force is used)
+    # If so, confirm with a head/tail fingerprint and skip processing (unless --force is used)
     # This check includes both readable AND writable directories to ensure we don't skip writing missing files
     if not FORCE:
         file_sizes: Set[int] = set()
-        file_paths_for_size_check: List[Path] = []
         all_dirs_have_file = True
         
-        for dir_path, mode in directories:
-            file_path = dir_path / relative_path
-            if file_path.exists():
-                file_sizes.add(file_path.stat().st_size)
-                file_paths_for_size_check.append(file_path)
+        for dir_idx, (dir_path, mode) in enumerate(directories):
+            if sizes is not None:
+                # Sizes recorded during discovery, no file system access needed
+                size = sizes.get((dir_idx, relative_path))
             else:
+                file_path = dir_path + relative_path
+                size = os.stat(file_path).st_size if os.path.exists(file_path) else None
+            
+            if size is None:
                 # If any directory is missing the file, we can't skip
                 all_dirs_have_file = False
+                break
+            file_sizes.add(size)
         
         # Only skip if:
         # 1. All directories have the file (no missing files to write)
         # 2. All existing files have identical size
-        # 3. At least one file exists
-        if all_dirs_have_file and len(file_sizes) == 1 and len(file_paths_for_size_check) > 0:
-            log_verbose(f"  All versions have identical size ({file_sizes.pop()} bytes), skipping merge")
-            return
+        # 3. All existing files have identical head/tail fingerprint
+        # Fingerprints are only computed once sizes agree, so differing sizes cost no reads
+        if all_dirs_have_file and len(file_sizes) == 1:
+            fingerprints = {file_fingerprint(dir_path + relative_path) for dir_path, _ in directories}
+            if len(fingerprints) == 1 and None not in fingerprints:
+                log_verbose(f"  All versions have identical size ({file_sizes.pop()} bytes) and fingerprint, skipping merge")
+                return
+            log_verbose("  Versions have identical size but different content, merging")
     
     # Step 1: Read all versions from readable directories
-    contents: List[str] = []
-    readable_found = False
+    # Contents are kept per directory so Step 4 can compare rw copies without reading them again
+    originals: Dict[str, bytes] = {}
     
     for dir_path, mode in directories:
         if mode not in ("r", "rw"):
             continue
         
-        file_path = dir_path / relative_path
-        if file_path.exists():
-            readable_found = True
+        file_path = dir_path + relative_path
+        if os.path.exists(file_path):
             content = read_file_content(file_path)
-            contents.append(content)
+            originals[dir_path] = content
             log_verbose(f"  Read from {dir_path}: {len(content)} bytes")
     
-    if not readable_found:
+    if not originals:
         log_verbose(f"  File not found in any readable directory")
         return
     
-    # Step 2: Merge all contents
-    combined = ''.join(contents)
-    
-    # Step 3: Sort and deduplicate
+    # Step 2 and 3: Merge all contents (in order of directory configuration), then sort and deduplicate
+    # The combined buffer is passed straight through so sort_chat_log holds its only reference
+    # and can free it once line endings are normalized
     try:
-        merged = sort_chat_log(combined, relative_path)
+        merged = sort_chat_log(b''.join(originals.values()), relative_path)
     except ValueError as e:
         log_error(str(e))
         log_error("Stopping processing to avoid data corruption.")
         sys.exit(1)
     
     # Step 4: Write to all writable directories
+    merged_size = len(merged)
+    
     for dir_path, mode in directories:
         if mode not in ("w", "rw"):
             continue
         
-        file_path = dir_path / relative_path
+        file_path = dir_path + relative_path
+        dir_name = os.path.basename(dir_path.rstrip(os.sep))
         
         # Ensure parent directory exists
-        parent_dir = file_path.parent
-        if not parent_dir.exists():
+        parent_dir = os.path.dirname(file_path)
+        if not os.path.isdir(parent_dir):
             if DRY_RUN:
                 log_info(f"Would create directory: {parent_dir}")
             else:
-                parent_dir.mkdir(parents=True, exist_ok=True)
+                os.makedirs(parent_dir, exist_ok=True)
                 log_verbose(f"Created directory: {parent_dir}")
         
         # Check if we need to write by comparing content
         needs_write = False
         action = "Adding"
         
-        if file_path.exists():
-            # Read existing file and compare with merged content
-            existing = read_file_content(file_path)
-            if existing != merged:
+        existing = originals.get(dir_path)
+        if existing is not None or os.path.exists(file_path):
+            if existing is not None:
+                # Already read in Step 1, compare in memory
+                needs_write = existing != merged
+            # Otherwise compare size first, then content chunk by chunk
+            elif os.stat(file_path).st_size == merged_size:
+                needs_write = not file_matches(file_path, merged)
+            else:
                 needs_write = True
+            
+            if needs_write:
                 action = "Updating"
             else:
                 # File content is identical, no write needed
-                log_verbose(f"  Skipping {dir_path.name} (content unchanged)")
+                log_verbose(f"  Skipping {dir_name} (content unchanged)")
         else:
             needs_write = True
             action = "Adding"
         
         if needs_write:
             if DRY_RUN:
-                log_info(f"Would {action.lower()}: {relative_path} in {dir_path.name}")
+                log_info(f"Would {action.lower()}: {relative_path} in {dir_name}")
             else:
-                file_path.write_text(merged, encoding='utf-8')
+                write_file_atomic(file_path, merged)
                 log_info(f"{action} {relative_path}...")
         else:
             # In dry-run mode, still report that file is unchanged
-            if DRY_RUN and file_path.exists():
-                log_verbose(f"  Would skip {dir_path.name} (content unchanged)")
+            if DRY_RUN and os.path.exists(file_path):
+                log_verbose(f"  Would skip {dir_name} (content unchanged)")
+
+
+def process_files(
+    relative_paths: List[str],
+    directories: List[Tuple[str, str]],
+    sizes: Optional[Dict[Tuple[int, str], int]] = None
+) -> None:
+    """
+    Merge several files concurrently using a thread pool.
+    
+    Files are independent, so their reads and writes can overlap. As soon as
+    any file fails (including the SystemExit raised on malformed timestamps),
+    files that have not started yet are cancelled. Merges already running are
+    allowed to finish, then the first error in submission order is re-raised
+    in the calling thread.
+    
+    Args:
+        relative_paths: Relative paths of the files to merge
+        directories: List of (path prefix, mode) tuples
+        sizes: File sizes from discover_files, passed to merge_and_sync_file
+    """
+    with ThreadPoolExecutor(max_workers=MAX_WORKERS) as executor:
+        futures = [
+            executor.submit(merge_and_sync_file, relative_path, directories, sizes)
+            for relative_path in relative_paths
+        ]
+        try:
+            wait(futures, return_when=FIRST_EXCEPTION)
+        finally:
+            # Stop starting new files once one has failed or the wait was interrupted;
+            # cancel() leaves running and finished futures alone
+            for future in futures:
+                future.cancel()
+    
+    # Leaving the executor waited for running merges, so every future is settled
+    for future in futures:
+        if not future.cancelled() and future.exception() is not None:
+            raise future.exception()
 
 
 def main() -> None:
@@ -577,7 +813,7 @@ Configuration:
     parser.add_argument(
         '-f', '--force',
         action='store_true',
-        help='Force processing all files, even if they appear identical by size'
+        help='Force processing all files, even if they appear identical by size and fingerprint'
     )
     
     parser.add_argument(
@@ -625,32 +861,32 @@ Configuration:
         log_error("No writable directories (w or rw) found")
         sys.exit(1)
     
+    # From here on directories are plain string prefixes for cheap path joins
+    dir_prefixes = [(dir_prefix(path), mode) for path, mode in existing_dirs]
+    
     # Discover all files
-    all_files = discover_files(existing_dirs, args.filters)
+    all_files, sizes = discover_files(dir_prefixes, args.filters)
     
     if not all_files:
         log_info("No chat log files found to process")
         return
     
-    # Group files by user directory for progress reporting
-    from collections import defaultdict
-    files_by_user: defaultdict = defaultdict(list)
-    for relative_path in sorted(all_files):
-        # Extract user directory (first component of path)
-        parts = relative_path.split('/')
-        if parts:
-            user_dir = parts[0]
-            files_by_user[user_dir].append(relative_path)
-    
-    # Process each file, grouped by user directory
-    log_info(f"Processing {len(all_files)} files across {len(files_by_user)} user directories...")
-    
-    for user_dir in sorted(files_by_user.keys()):
-        user_files = files_by_user[user_dir]
-        log_info(f"  {user_dir}: {len(user_files)} file(s)")
-        
-        for relative_path in user_files:
-            merge_and_sync_file(relative_path, existing_dirs)
+    # Group files by user directory (first component of path) for progress reporting
+    # Sorting on the split path orders by user directory, then by path within it
+    ordered_files = sorted(all_files, key=lambda relative_path: relative_path.split('/', 1))
+    user_groups = [
+        (user_dir, sum(1 for _ in user_files))
+        for user_dir, user_files in groupby(ordered_files, key=lambda relative_path: relative_path.split('/', 1)[0])
+    ]
+    
+    # Report the per-user breakdown up front, then process every file in one pool
+    # so no user directory has to wait for the previous one to drain
+    log_info(f"Processing {len(all_files)} files across {len(user_groups)} user directories...")
+    
+    for user_dir, file_count in user_groups:
+        log_info(f"  {user_dir}: {file_count} file(s)")
+    
+    process_files(ordered_files, dir_prefixes, sizes)
     
     if DRY_RUN:
         log_info("=== DRY RUN COMPLETE - No actual changes were made ===")
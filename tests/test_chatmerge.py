@@ -6,6 +6,7 @@ import pytest
 from pathlib import Path
 import sys
 import os
+import time
 
 # Add parent directory to path to import sl-chatmerge
 sys.path.insert(0, str(Path(__file__).parent.parent))
@@ -16,6 +17,11 @@ sl_chatmerge = importlib.util.module_from_spec(spec)
 spec.loader.exec_module(sl_chatmerge)
 
 
+def _lines(result):
+    """Split sorted output into its lines, without the trailing newline."""
+    return result.rstrip(b'\n').split(b'\n')
+
+
 class TestPathHandling:
     """Test path expansion and validation."""
     
@@ -40,23 +46,27 @@ class TestPathHandling:
 class TestFileExclusion:
     """Test file exclusion logic."""
     
-    def test_exclude_conflicted_copy(self):
-        """Test that conflicted copy files are excluded."""
-        assert sl_chatmerge.should_exclude_file("logs/chat (conflicted copy).txt")
-        assert sl_chatmerge.should_exclude_file("logs/Chat (Conflicted Copy).txt")
-    
-    def test_exclude_system_files(self):
-        """Test that system files are excluded."""
-        assert sl_chatmerge.should_exclude_file("logs/cef_log.txt")
-        assert sl_chatmerge.should_exclude_file("logs/plugin_cookies.txt")
-        assert sl_chatmerge.should_exclude_file("logs/search_history.txt")
-        assert sl_chatmerge.should_exclude_file("logs/teleport_history.txt")
-        assert sl_chatmerge.should_exclude_file("logs/typed_locations.txt")
-    
-    def test_include_regular_files(self):
-        """Test that regular chat files are not excluded."""
-        assert not sl_chatmerge.should_exclude_file("logs/Jane Doe.txt")
-        assert not sl_chatmerge.should_exclude_file("logs/group/Meeting.txt")
+    @pytest.mark.parametrize("path,excluded", [
+        # Conflicted copies
+        ("logs/chat (conflicted copy).txt", True),
+        ("logs/Chat (Conflicted Copy).txt", True),
+        # System files
+        ("logs/cef_log.txt", True),
+        ("logs/plugin_cookies.txt", True),
+        ("logs/search_history.txt", True),
+        ("logs/teleport_history.txt", True),
+        ("logs/typed_locations.txt", True),
+        ("jane_doe/avatar_icons_cache.txt", True),
+        ("jane_doe/render_mute_settings.txt", True),
+        ("Jane_Doe/Search_History.TXT", True),
+        # Regular chat files
+        ("logs/Jane Doe.txt", False),
+        ("logs/group/Meeting.txt", False),
+        ("jane_doe/old_search_history.txt", False),
+    ])
+    def test_should_exclude_file(self, path, excluded):
+        """Test that conflicted copies and system files are excluded, chat logs are not."""
+        assert sl_chatmerge.should_exclude_file(path) is excluded
 
 
 class TestSortFunction:
@@ -64,87 +74,122 @@ class TestSortFunction:
     
     def test_line_ending_normalization(self):
         """Test that CRLF is converted to LF."""
-        content = "[2024/01/01 12:00:00] User: Hello\r\n[2024/01/01 12:01:00] User: World\r\n"
+        content = b"[2024/01/01 12:00:00] User: Hello\r\n[2024/01/01 12:01:00] User: World\r\n"
         result = sl_chatmerge.sort_chat_log(content, "test.txt")
-        assert '\r' not in result
-        assert result.count('\n') >= 2
+        assert b'\r' not in result
+        assert result.count(b'\n') >= 2
+    
+    def test_lone_cr_is_line_break(self):
+        """Test that old Mac-style lone CR line endings still separate entries."""
+        content = b"[2024/01/01 12:01:00] User: Second\r[2024/01/01 12:00:00] User: First\r"
+        lines = _lines(sl_chatmerge.sort_chat_log(content, "test.txt"))
+        assert lines == [
+            b"[2024/01/01 12:00:00] User: First",
+            b"[2024/01/01 12:01:00] User: Second",
+        ]
     
     def test_empty_file(self):
-        """Test that empty files get a newline."""
-        result = sl_chatmerge.sort_chat_log("", "test.txt")
-        assert result == '\n'
+        """Test that empty files stay empty."""
+        result = sl_chatmerge.sort_chat_log(b"", "test.txt")
+        assert result == b''
     
     def test_chronological_sorting(self):
         """Test that entries are sorted by timestamp."""
-        content = """[2024/01/01 12:01:00] User: Second
+        content = b"""[2024/01/01 12:01:00] User: Second
 [2024/01/01 12:00:00] User: First
 [2024/01/01 12:02:00] User: Third
 """
-        result = sl_chatmerge.sort_chat_log(content, "test.txt")
-        lines = result.strip().split('\n')
-        assert "First" in lines[0]
-        assert "Second" in lines[1]
-        assert "Third" in lines[2]
+        lines = _lines(sl_chatmerge.sort_chat_log(content, "test.txt"))
+        assert b"First" in lines[0]
+        assert b"Second" in lines[1]
+        assert b"Third" in lines[2]
+    
+    def test_variable_width_timestamps_sorted_chronologically(self):
+        """Test that short, 12-hour and unbracketed timestamps sort by time."""
+        content = b"""[2024/01/01 10:00:00] User: Ten
+[2024/01/01 9:05] User: Nine
+[2024/01/01 1:30 PM] User: Afternoon
+2024/01/01 8:15 User: Eight
+"""
+        lines = _lines(sl_chatmerge.sort_chat_log(content, "test.txt"))
+        assert lines == [
+            b"[2024/01/01 08:15] User: Eight",
+            b"[2024/01/01 09:05] User: Nine",
+            b"[2024/01/01 10:00:00] User: Ten",
+            b"[2024/01/01 13:30] User: Afternoon",
+        ]
     
     def test_multi_line_entries(self):
         """Test that multi-line entries stay together."""
-        content = """[2024/01/01 12:01:00] User: Second
+        content = b"""[2024/01/01 12:01:00] User: Second
 This is line 2
 This is line 3
 [2024/01/01 12:00:00] User: First
 Also multiline
 """
-        result = sl_chatmerge.sort_chat_log(content, "test.txt")
+        lines = _lines(sl_chatmerge.sort_chat_log(content, "test.txt"))
         # First entry should come first and stay together
-        assert result.index("First") < result.index("Second")
-        assert result.index("Also multiline") < result.index("Second")
+        assert lines == [
+            b"[2024/01/01 12:00:00] User: First",
+            b"Also multiline",
+            b"[2024/01/01 12:01:00] User: Second",
+            b"This is line 2",
+            b"This is line 3",
+        ]
     
     def test_consecutive_deduplication(self):
         """Test that consecutive duplicates are removed."""
-        content = """[2024/01/01 12:00:00] User: Hello
+        content = b"""[2024/01/01 12:00:00] User: Hello
 [2024/01/01 12:00:00] User: Hello
 [2024/01/01 12:01:00] User: World
 """
-        result = sl_chatmerge.sort_chat_log(content, "test.txt")
+        lines = _lines(sl_chatmerge.sort_chat_log(content, "test.txt"))
         # Should only have 2 entries
-        assert result.count("[2024/01/01 12:00:00] User: Hello") == 1
-        assert result.count("[2024/01/01 12:01:00] User: World") == 1
+        assert lines == [
+            b"[2024/01/01 12:00:00] User: Hello",
+            b"[2024/01/01 12:01:00] User: World",
+        ]
     
     def test_non_consecutive_duplicates_kept(self):
         """Test that non-consecutive duplicates are NOT removed."""
-        content = """[2024/01/01 12:00:00] User: Hello
+        content = b"""[2024/01/01 12:00:00] User: Hello
 [2024/01/01 12:01:00] User: World
 [2024/01/01 12:02:00] User: Hello
 """
-        result = sl_chatmerge.sort_chat_log(content, "test.txt")
+        lines = _lines(sl_chatmerge.sort_chat_log(content, "test.txt"))
         # Should have both Hello entries
-        assert result.count("Hello") == 2
+        assert sum(1 for e in lines if e.endswith(b"User: Hello")) == 2
     
     def test_trailing_newline(self):
         """Test that output ends with newline."""
-        content = "[2024/01/01 12:00:00] User: Test"
+        content = b"[2024/01/01 12:00:00] User: Test"
         result = sl_chatmerge.sort_chat_log(content, "test.txt")
-        assert result.endswith('\n')
+        assert result.endswith(b'\n')
     
     def test_malformed_timestamp_raises_error(self):
         """Test that malformed timestamps raise an error."""
-        content = "[2024-01-01 12:00:00] User: Wrong format\n"
+        content = b"[2024-01-01 12:00:00] User: Wrong format\n"
         with pytest.raises(ValueError) as exc_info:
             sl_chatmerge.sort_chat_log(content, "test.txt")
         assert "Malformed timestamp" in str(exc_info.value)
     
     def test_locale_independent_sorting(self):
         """Test that sorting is byte-wise, not locale-dependent."""
-        content = """[2024/01/01 12:00:00] User: A
+        content = b"""[2024/01/01 12:00:00] User: A
 [2024/01/01 12:00:00] User: B
 [2024/01/01 12:00:00] User: a
 """
-        result = sl_chatmerge.sort_chat_log(content, "test.txt")
-        lines = result.strip().split('\n')
+        lines = _lines(sl_chatmerge.sort_chat_log(content, "test.txt"))
         # Byte-wise sorting: uppercase comes before lowercase in ASCII
-        assert lines[0].endswith(": A")
-        assert lines[1].endswith(": B")
-        assert lines[2].endswith(": a")
+        assert lines[0].endswith(b": A")
+        assert lines[1].endswith(b": B")
+        assert lines[2].endswith(b": a")
+    
+    def test_non_utf8_content_preserved(self):
+        """Test that non-UTF-8 bytes pass through unchanged."""
+        content = b"[2024/01/01 12:00:00] User: caf\xe9\n"
+        result = sl_chatmerge.sort_chat_log(content, "test.txt")
+        assert result == content
 
 
 class TestConfigValidation:
@@ -152,40 +197,32 @@ class TestConfigValidation:
     
     def test_validate_config_succeeds(self):
         """Test that valid config passes validation."""
-        # Save original
-        original = sl_chatmerge.DIRECTORIES
-        try:
-            sl_chatmerge.DIRECTORIES = [
-                {"path": "/test", "mode": "rw"},
-            ]
-            config = sl_chatmerge.validate_config()
-            assert len(config) == 1
-        finally:
-            sl_chatmerge.DIRECTORIES = original
+        config = sl_chatmerge.validate_config([
+            {"path": "/test", "mode": "rw"},
+        ])
+        assert len(config) == 1
+    
+    def test_validate_config_empty(self, capsys):
+        """Test that an explicitly empty config is rejected without blaming DIRECTORIES."""
+        with pytest.raises(SystemExit):
+            sl_chatmerge.validate_config([])
+        err = capsys.readouterr().err
+        assert "No directories configured" in err
+        assert "DIRECTORIES" not in err
     
     def test_validate_config_missing_mode(self):
         """Test that missing mode field is caught."""
-        original = sl_chatmerge.DIRECTORIES
-        try:
-            sl_chatmerge.DIRECTORIES = [
+        with pytest.raises(SystemExit):
+            sl_chatmerge.validate_config([
                 {"path": "/test"},
-            ]
-            with pytest.raises(SystemExit):
-                sl_chatmerge.validate_config()
-        finally:
-            sl_chatmerge.DIRECTORIES = original
+            ])
     
     def test_validate_config_invalid_mode(self):
         """Test that invalid mode value is caught."""
-        original = sl_chatmerge.DIRECTORIES
-        try:
-            sl_chatmerge.DIRECTORIES = [
+        with pytest.raises(SystemExit):
+            sl_chatmerge.validate_config([
                 {"path": "/test", "mode": "invalid"},
-            ]
-            with pytest.raises(SystemExit):
-                sl_chatmerge.validate_config()
-        finally:
-            sl_chatmerge.DIRECTORIES = original
+            ])
 
 
 class TestIntegration:
@@ -199,92 +236,226 @@ class TestIntegration:
         
         (dir1 / "logs").mkdir(parents=True)
         (dir2 / "logs").mkdir(parents=True)
+        (dir1 / "jane_doe").mkdir()
+        (dir2 / "jane_doe").mkdir()
         
         return dir1, dir2
     
+    @pytest.fixture
+    def existing_dirs(self, temp_dirs):
+        """Both temporary directories as read-write (path prefix, mode) tuples."""
+        dir1, dir2 = temp_dirs
+        return [
+            (sl_chatmerge.dir_prefix(dir1), "rw"),
+            (sl_chatmerge.dir_prefix(dir2), "rw"),
+        ]
+    
     def test_merge_simple_files(self, temp_dirs):
         """Test merging files from two directories."""
         dir1, dir2 = temp_dirs
         
         # Create file in dir1
-        (dir1 / "logs" / "test.txt").write_text(
-            "[2024/01/01 12:00:00] User: From dir1\n"
+        (dir1 / "jane_doe" / "test.txt").write_bytes(
+            b"[2024/01/01 12:00:00] User: From dir1\n"
         )
         
         # Create file in dir2 with different content
-        (dir2 / "logs" / "test.txt").write_text(
-            "[2024/01/01 12:01:00] User: From dir2\n"
+        (dir2 / "jane_doe" / "test.txt").write_bytes(
+            b"[2024/01/01 12:01:00] User: From dir2, later\n"
         )
         
-        # Mock configuration
-        original = sl_chatmerge.DIRECTORIES
-        try:
-            sl_chatmerge.DIRECTORIES = [
-                {"path": str(dir1), "mode": "rw"},
-                {"path": str(dir2), "mode": "rw"},
-            ]
-            
-            # Get existing dirs
-            config = sl_chatmerge.validate_config()
-            existing_dirs = []
-            for dir_config in config:
-                exists, path = sl_chatmerge.check_directory_exists(dir_config)
-                if exists and path:
-                    existing_dirs.append((path, dir_config["mode"]))
-            
-            # Discover files
-            all_files = sl_chatmerge.discover_files(existing_dirs, [])
-            assert "logs/test.txt" in all_files
-            
-            # Merge
-            sl_chatmerge.merge_and_sync_file("logs/test.txt", existing_dirs)
-            
-            # Check both files now have merged content
-            content1 = (dir1 / "logs" / "test.txt").read_text()
-            content2 = (dir2 / "logs" / "test.txt").read_text()
-            
-            assert content1 == content2
-            assert "From dir1" in content1
-            assert "From dir2" in content1
-            
-        finally:
-            sl_chatmerge.DIRECTORIES = original
+        # Get existing dirs
+        config = sl_chatmerge.validate_config([
+            {"path": str(dir1), "mode": "rw"},
+            {"path": str(dir2), "mode": "rw"},
+        ])
+        existing_dirs = []
+        for dir_config in config:
+            exists, path = sl_chatmerge.check_directory_exists(dir_config)
+            if exists and path:
+                existing_dirs.append((sl_chatmerge.dir_prefix(path), dir_config["mode"]))
+        
+        # Discover files
+        all_files, sizes = sl_chatmerge.discover_files(existing_dirs, [])
+        assert "jane_doe/test.txt" in all_files
+        assert sizes[(0, "jane_doe/test.txt")] == (dir1 / "jane_doe" / "test.txt").stat().st_size
+        
+        # Merge
+        sl_chatmerge.merge_and_sync_file("jane_doe/test.txt", existing_dirs, sizes)
+        
+        # Check both files now have merged content
+        content1 = (dir1 / "jane_doe" / "test.txt").read_bytes()
+        content2 = (dir2 / "jane_doe" / "test.txt").read_bytes()
+        
+        assert content1 == content2
+        assert b"From dir1" in content1
+        assert b"From dir2" in content1
+    
+    def test_same_size_different_content_merged(self, temp_dirs, existing_dirs):
+        """Test that same-size files with different content are not skipped."""
+        dir1, dir2 = temp_dirs
+        
+        (dir1 / "jane_doe" / "same.txt").write_bytes(b"[2024/01/01 12:00:00] User: Hello\n")
+        (dir2 / "jane_doe" / "same.txt").write_bytes(b"[2024/01/01 12:00:00] User: Howdy\n")
+        
+        all_files, sizes = sl_chatmerge.discover_files(existing_dirs, [])
+        assert sizes[(0, "jane_doe/same.txt")] == sizes[(1, "jane_doe/same.txt")]
+        
+        sl_chatmerge.merge_and_sync_file("jane_doe/same.txt", existing_dirs, sizes)
+        
+        content1 = (dir1 / "jane_doe" / "same.txt").read_bytes()
+        assert content1 == (dir2 / "jane_doe" / "same.txt").read_bytes()
+        assert b"Hello" in content1
+        assert b"Howdy" in content1
     
     def test_empty_file_handling(self, temp_dirs):
         """Test that empty files are handled correctly."""
         dir1, dir2 = temp_dirs
         
         # Create empty file in dir1
-        (dir1 / "logs" / "empty.txt").write_text("")
+        (dir1 / "jane_doe" / "empty.txt").write_bytes(b"")
         
         # Create file with content in dir2
-        (dir2 / "logs" / "empty.txt").write_text(
-            "[2024/01/01 12:00:00] User: Content\n"
+        (dir2 / "jane_doe" / "empty.txt").write_bytes(
+            b"[2024/01/01 12:00:00] User: Content\n"
         )
         
-        # Mock configuration
-        original = sl_chatmerge.DIRECTORIES
+        config = sl_chatmerge.validate_config([
+            {"path": str(dir1), "mode": "rw"},
+            {"path": str(dir2), "mode": "rw"},
+        ])
+        existing_dirs = []
+        for dir_config in config:
+            exists, path = sl_chatmerge.check_directory_exists(dir_config)
+            if exists and path:
+                existing_dirs.append((sl_chatmerge.dir_prefix(path), dir_config["mode"]))
+        
+        sl_chatmerge.merge_and_sync_file("jane_doe/empty.txt", existing_dirs)
+        
+        # Both should now have the content
+        content1 = (dir1 / "jane_doe" / "empty.txt").read_bytes()
+        content2 = (dir2 / "jane_doe" / "empty.txt").read_bytes()
+        
+        assert b"Content" in content1
+        assert b"Content" in content2
+    
+    def test_unchanged_file_not_rewritten(self, temp_dirs, existing_dirs, monkeypatch):
+        """Test that a second merge leaves already merged files untouched."""
+        dir1, dir2 = temp_dirs
+        (dir1 / "jane_doe" / "test.txt").write_bytes(b"[2024/01/01 12:00:00] User: From dir1\n")
+        (dir2 / "jane_doe" / "test.txt").write_bytes(b"[2024/01/01 12:01:00] User: From dir2, later\n")
+        sl_chatmerge.merge_and_sync_file("jane_doe/test.txt", existing_dirs)
+        
+        # Backdate the merged files so any rewrite would change the mtime
+        for d in (dir1, dir2):
+            os.utime(d / "jane_doe" / "test.txt", ns=(0, 0))
+        
+        # Bypass the size/fingerprint skip so the content comparison is exercised
+        monkeypatch.setattr(sl_chatmerge, "FORCE", True)
+        sl_chatmerge.merge_and_sync_file("jane_doe/test.txt", existing_dirs)
+        
+        for d in (dir1, dir2):
+            assert (d / "jane_doe" / "test.txt").stat().st_mtime_ns == 0
+    
+    def test_process_files_merges_many_files(self, temp_dirs, existing_dirs):
+        """Test that concurrent processing merges every file."""
+        dir1, dir2 = temp_dirs
+        names = ["jane_doe/chat%03d.txt" % i for i in range(100)]
+        for name in names:
+            (dir1 / name).write_bytes(b"[2024/01/01 12:00:00] User: From dir1\n")
+            (dir2 / name).write_bytes(b"[2024/01/01 12:01:00] User: From dir2, later\n")
+        
+        all_files, sizes = sl_chatmerge.discover_files(existing_dirs, [])
+        assert all_files == set(names)
+        
+        sl_chatmerge.process_files(sorted(all_files), existing_dirs, sizes)
+        
+        expected = (
+            b"[2024/01/01 12:00:00] User: From dir1\n"
+            b"[2024/01/01 12:01:00] User: From dir2, later\n"
+        )
+        for name in names:
+            assert (dir1 / name).read_bytes() == expected
+            assert (dir2 / name).read_bytes() == expected
+    
+    def test_process_files_stops_after_failure(self, monkeypatch):
+        """Test that a failing file stops later files from starting."""
+        started = []
+        
+        def fake_merge(relative_path, directories, sizes=None):
+            started.append(relative_path)
+            if relative_path == "f0":
+                time.sleep(0.2)  # Keep the first future pending while the failure is raised
+            elif relative_path == "f1":
+                sys.exit(1)
+        
+        monkeypatch.setattr(sl_chatmerge, "MAX_WORKERS", 2)
+        monkeypatch.setattr(sl_chatmerge, "merge_and_sync_file", fake_merge)
+        
+        with pytest.raises(SystemExit):
+            sl_chatmerge.process_files(["f%d" % i for i in range(200)], [])
+        
+        # Only files picked up before the cancellation may have started
+        assert len(started) < 10
+    
+    def test_atomic_write_replaces_file(self, temp_dirs):
+        """Test that atomic writes replace content and leave no temporary file."""
+        dir1, _ = temp_dirs
+        target = dir1 / "jane_doe" / "atomic.txt"
+        target.write_bytes(b"old\n")
+        
+        sl_chatmerge.write_file_atomic(str(target), b"new\n")
+        
+        assert target.read_bytes() == b"new\n"
+        assert sorted(p.name for p in target.parent.iterdir()) == ["atomic.txt"]
+    
+    def test_atomic_write_preserves_mode(self, temp_dirs):
+        """Test that atomic writes keep the existing file's permissions."""
+        dir1, _ = temp_dirs
+        target = dir1 / "jane_doe" / "private.txt"
+        target.write_bytes(b"old\n")
+        os.chmod(target, 0o600)
+        
+        sl_chatmerge.write_file_atomic(str(target), b"new\n")
+        
+        assert target.read_bytes() == b"new\n"
+        assert target.stat().st_mode & 0o777 == 0o600
+    
+    def test_atomic_write_new_file_uses_default_mode(self, temp_dirs):
+        """Test that newly created files get the mode derived from the umask."""
+        dir1, _ = temp_dirs
+        target = dir1 / "jane_doe" / "new.txt"
+        
+        old_umask = os.umask(0o027)
         try:
-            sl_chatmerge.DIRECTORIES = [
-                {"path": str(dir1), "mode": "rw"},
-                {"path": str(dir2), "mode": "rw"},
-            ]
-            
-            config = sl_chatmerge.validate_config()
-            existing_dirs = []
-            for dir_config in config:
-                exists, path = sl_chatmerge.check_directory_exists(dir_config)
-                if exists and path:
-                    existing_dirs.append((path, dir_config["mode"]))
-            
-            sl_chatmerge.merge_and_sync_file("logs/empty.txt", existing_dirs)
-            
-            # Both should now have the content
-            content1 = (dir1 / "logs" / "empty.txt").read_text()
-            content2 = (dir2 / "logs" / "empty.txt").read_text()
-            
-            assert "Content" in content1
-            assert "Content" in content2
-            
+            sl_chatmerge.write_file_atomic(str(target), b"new\n")
         finally:
-            sl_chatmerge.DIRECTORIES = original
+            os.umask(old_umask)
+        
+        assert target.read_bytes() == b"new\n"
+        assert target.stat().st_mode & 0o777 == 0o640
+        assert sorted(p.name for p in target.parent.iterdir()) == ["new.txt"]
+    
+    def test_atomic_write_follows_symlink(self, temp_dirs):
+        """Test that atomic writes update a symlink's target and keep the link."""
+        dir1, dir2 = temp_dirs
+        real = dir2 / "jane_doe" / "real.txt"
+        real.write_bytes(b"old\n")
+        link = dir1 / "jane_doe" / "link.txt"
+        link.symlink_to(real)
+        
+        sl_chatmerge.write_file_atomic(str(link), b"new\n")
+        
+        assert link.is_symlink()
+        assert real.read_bytes() == b"new\n"
+        assert sorted(p.name for p in real.parent.iterdir()) == ["real.txt"]
+    
+    def test_file_matches(self, tmp_path):
+        """Test chunked comparison of file content against merged bytes."""
+        target = tmp_path / "compare.txt"
+        target.write_bytes(b"[2024/01/01 12:00:00] User: Hello\n")
+        
+        assert sl_chatmerge.file_matches(str(target), b"[2024/01/01 12:00:00] User: Hello\n")
+        assert not sl_chatmerge.file_matches(str(target), b"[2024/01/01 12:00:00] User: Hallo\n")
+        assert not sl_chatmerge.file_matches(str(target), b"[2024/01/01 12:00:00] User: Hello\nmore\n")
+        assert not sl_chatmerge.file_matches(str(target), b"[2024/01/01")